@@ -0,0 +1,136 @@
+'''
+About: Python script to store the extracted (position, force, time) curves in a compact format
+and to convert the already extracted text files of the Biomomentum Mach 1 micromechanical testing system.
+Author: Iman Kafian-Attari
+Date: 18.07.2021
+Licence: MIT
+version: 0.1
+=========================================================
+How to use:
+1. Select the folder containing the extracted step-wise stress-relaxation or sinusoid loading text files.
+2. Choose whether to remove the text files after their conversion.
+3. Repeat the process for the remaining folders, if needed.
+=========================================================
+Notes:
+1. This code is meant to cut the disk use and read time of the extracted curves,
+   it is used by the extraction codes when the compact format is chosen.
+2. The compact files are saved as .npz numpy archives holding:
+   - the position as float32, delta encoded and compressed with zlib,
+   - the force as float32, compressed with zlib,
+   - the time as its start and sampling interval if it is uniform at float32 precision,
+     otherwise as float64, delta encoded and compressed with zlib.
+3. The delta encoding is done on the bits of the values, so the float32 values are restored exactly,
+   and the uniform time is restored within the float32 precision of the measured time.
+4. The curves are read by load_curve in the form of multiple rows x 3 columns, whatever their format:
+-  The 1st column is the absolute position Z (mm), the 2nd column is force (n), and the 3rd column is time (s).
+=========================================================
+TODO for version O.2
+1. Store the bulk data in the compact format as well.
+=========================================================
+'''
+
+import numpy as np
+import os
+import zlib
+import tkinter as tk
+from tkinter import filedialog
+
+# Extension of the compact files
+compact_extension = '.npz'
+
+
+def encode_channel(values, dtype, delta):
+    # Compressing a channel with zlib after casting it to dtype, optionally delta encoding the bits of the values
+    bits = np.ascontiguousarray(values, dtype=dtype).view(f'i{np.dtype(dtype).itemsize}')
+    if delta:
+        bits = np.diff(bits, prepend=bits.dtype.type(0)) # Integer deltas wrap around, so they are lossless
+    return np.frombuffer(zlib.compress(bits.tobytes()), dtype=np.uint8)
+
+
+def decode_channel(encoded, dtype, delta):
+    # Restoring a channel encoded by encode_channel as float64
+    bits = np.frombuffer(zlib.decompress(encoded.tobytes()), dtype=f'i{np.dtype(dtype).itemsize}')
+    if delta:
+        bits = np.cumsum(bits, dtype=bits.dtype)
+    return bits.view(dtype).astype(float)
+
+
+def save_curve(file, curve, compact=False):
+    # Storing a (position, force, time) curve as a text file, or as a compact file if compact is True
+    # The extension of the file is replaced by .npz in the compact format, returns the path of the stored file
+    if not compact:
+        np.savetxt(file, curve, delimiter='\t')
+        return file
+
+    file = os.path.splitext(file)[0] + compact_extension
+    time = np.asarray(curve[:, 2], dtype=float)
+    channels = {'rows': np.array(len(curve)),
+                'position': encode_channel(curve[:, 0], np.float32, True),
+                'force': encode_channel(curve[:, 1], np.float32, False)}
+
+    # Storing the time as start + interval if the uniform time matches the measured time at float32 precision
+    if len(time) > 1:
+        interval = (time[-1] - time[0]) / (len(time) - 1)
+        uniform = np.array_equal(np.float32(time[0] + interval*np.arange(len(time))), np.float32(time))
+    else:
+        interval, uniform = 0.0, True
+    if uniform:
+        channels['time_start'] = np.array(time[0] if len(time) > 0 else 0.0)
+        channels['time_interval'] = np.array(interval)
+    else:
+        channels['time'] = encode_channel(time, np.float64, True)
+
+    # Saving through an open file, so that numpy does not append its own .npz extension
+    with open(file, 'wb') as f:
+        np.savez(f, **channels)
+    return file
+
+
+def load_curve(file):
+    # Reading a (position, force, time) curve stored as a text or a compact file, as a 2D numpy array
+    if os.path.splitext(file)[1] != compact_extension:
+        return np.loadtxt(file)
+
+    with np.load(file) as channels:
+        rows = int(channels['rows'])
+        curve = np.zeros((rows, 3))
+        curve[:, 0] = decode_channel(channels['position'], np.float32, True)
+        curve[:, 1] = decode_channel(channels['force'], np.float32, False)
+        if 'time' in channels:
+            curve[:, 2] = decode_channel(channels['time'], np.float64, True)
+        else:
+            curve[:, 2] = channels['time_start'] + channels['time_interval']*np.arange(rows)
+    return curve
+
+
+if __name__ == '__main__':
+
+    print(__doc__)
+
+    root = tk.Tk()
+    root.withdraw()
+
+    condition = True
+    while condition == True:
+
+        # Selecting the folder containing the extracted curves
+        input_directory = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the extracted curves directory')
+
+        # Choosing whether the text files are kept
+        remove = input('Do you want to remove the text files after their conversion?(Y/N) --> ')
+
+        # Converting the step-wise and per-frequency curves, the bulk data and the QC summaries are kept as text
+        for file in sorted(os.listdir(input_directory)):
+            if file.endswith('.txt') and ('-StressRelax-step' in file or '-SinusoidLoading-' in file) and '-QC-' not in file:
+                save_curve(os.path.join(input_directory, file), load_curve(os.path.join(input_directory, file)), compact=True)
+                if remove == 'Y':
+                    os.remove(os.path.join(input_directory, file))
+
+        check = input('Do you want to continue?(Y/N) --> ')
+        if check == 'Y':
+            condition = True
+        elif check == 'N':
+            condition = False
+        else:
+            print('Wrong input --> Exiting...')
+            exit()
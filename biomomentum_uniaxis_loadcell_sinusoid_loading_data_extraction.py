@@ -8,7 +8,8 @@ version: 0.1
 =========================================================
 How to use:
 1. Select the folder containing the input files.
-2. Repeat the process for the remaining samples, if needed.
+2. Choose whether to store the sinusoid loading data in the compact format.
+3. Repeat the process for the remaining samples, if needed.
 =========================================================
 Notes:
 1. This code is meant to extract the sinusoid loading dataset when a uniaxis loadcell is used.
@@ -18,6 +19,12 @@ Notes:
 4. The sinusoid loading output files are in the form of multiple rows x 3 columns:
 -  The 1st column is the absolute position Z (mm), the 2nd column is force (n), and the 3rd column is time (s).
 5. It automatically finds the used frequency and stores it in the label of the output file.
+6. A QC summary is saved per file, computed while the frequencies are being parsed, in the form of one row per frequency:
+-  frequency index, rows, NaN count, min force (n), max force (n), time monotonic (1/0), sampling rate (Hz),
+-  terminated by <END DATA> (1/0), and OK (1/0).
+-  A frequency is not OK if it has NaN values or a non-monotonic time, or if its <END DATA> is missing.
+7. The per-frequency output files can be saved in the compact format of biomomentum_compact_curve_storage (.npz),
+   they are read by its load_curve the same way as the text files.
 =========================================================
 TODO for version O.2
 1. Read the data for other axes.
@@ -34,6 +41,24 @@ import os
 import tkinter as tk
 from tkinter import filedialog
 import shutil
+from biomomentum_compact_curve_storage import save_curve
+
+# Header of the QC summary
+qc_header = 'frequency\trows\tnan_count\tforce_min\tforce_max\ttime_monotonic\tsampling_rate\tterminated\tok'
+
+
+def frequency_quality_control(frequency_count, np_sinusoid):
+    # Building the QC row of a single frequency from its (position, force, time) array
+    rows = len(np_sinusoid)
+    nan_count = int(np.count_nonzero(np.isnan(np_sinusoid)))
+    force_min = np.nanmin(np_sinusoid[:, 1]) if rows > 0 else np.nan
+    force_max = np.nanmax(np_sinusoid[:, 1]) if rows > 0 else np.nan
+    time_step = np.diff(np_sinusoid[:, 2])
+    time_monotonic = int(np.all(time_step > 0))
+    sampling_rate = 1/np.nanmedian(time_step) if rows > 1 and time_monotonic == 1 else np.nan
+    ok = int(nan_count == 0 and time_monotonic == 1 and rows > 1)
+    return [frequency_count, rows, nan_count, force_min, force_max, time_monotonic, sampling_rate, 1, ok]
+
 
 root = tk.Tk()
 root.withdraw()
@@ -44,6 +69,9 @@ while condition == True:
     # Selecting the folder containing input dataset
     input_directory = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the input directory')
 
+    # Choosing the storage format of the per-frequency output files
+    compact = input('Do you want to store the sinusoid loading data in the compact format?(Y/N) --> ') == 'Y'
+
     # Listing all the inputs
     input_files = sorted(os.listdir(input_directory), key=lambda x: int("".join([i for i in x if i.isdigit()])))
 
@@ -59,12 +87,13 @@ while condition == True:
     for file in input_files:
 
         # Creating a folder specific to Sinusoid Loading output files:
-        if not os.path.exists(f'{input_directory}\\Output\\Sinuosoid-Loading'):
-            os.mkdir(f'{input_directory}\\Output\\Sinuosoid-Loading')
+        if not os.path.exists(f'{input_directory}\\Output\\Sinusoid-Loading'):
+            os.mkdir(f'{input_directory}\\Output\\Sinusoid-Loading')
 
         sinusoid = [] # A placeholder for the sinusoid data
         sinusoid_flag = 0 # A flag for sinusoid data in the raw input file
         frequency_count = 0 # a flag for each sinusoid frequency  in the raw input file
+        qc_summary = [] # A placeholder for the QC summary of the frequencies
 
         # Extracting the sinusoid bulk data
         # <--> Reading all the dataset with <Sinusoid> and <End Data> tags
@@ -86,7 +115,7 @@ while condition == True:
                     sinusoid_flag = 0 # Turning off the frequency flag for the next sinusoid loading data
 
                     # Finding the frequency in metadata
-                    frequency = '\t'.split(sinusoid[3])[1]
+                    frequency = sinusoid[3][1]
 
                     # Cleansing the data from its metadata information
                     tmp_sinusoid = sinusoid[7:]
@@ -99,13 +128,24 @@ while condition == True:
                         np_sinusoid[i][1] = np.abs(float(tmp_sinusoid[i][4]))*9.81*0.001
                         np_sinusoid[i][2] = float(tmp_sinusoid[i][0]) # Time (s)
 
-                    np.savetxt(f'{input_directory}\\Output\\Sinusoid-Loading\\'
-                               f'{file[:-4]}-SinusoidLoading-{frequency}Hz-UniAxisLoadCell.txt', np_sinusoid, delimiter='\t')
+                    save_curve(f'{input_directory}\\Output\\Sinusoid-Loading\\'
+                               f'{file[:-4]}-SinusoidLoading-{frequency}Hz-UniAxisLoadCell.txt', np_sinusoid, compact)
+
+                    # Checking the quality of the frequency while its data is still in memory
+                    qc_summary.append(frequency_quality_control(frequency_count, np_sinusoid))
 
                     # Emptying the placeholders for the next frequency
                     sinusoid = []
                     tmp_sinusoid = []
 
+        # Flagging the last frequency if its <END DATA> is missing, its rows are not stored
+        if sinusoid_flag == 1:
+            qc_summary.append([frequency_count, max(len(sinusoid)-7, 0), np.nan, np.nan, np.nan, np.nan, np.nan, 0, 0])
+
+        # Storing the QC summary for the sample
+        np.savetxt(f'{input_directory}\\Output\\Sinusoid-Loading\\{file[:-4]}-SinusoidLoading-QC-UniAxisLoadCell.txt',
+                   np.array(qc_summary, dtype='float').reshape(-1, 9), delimiter='\t', fmt='%g', header=qc_header)
+
         # Relocating the sample to the input folder
         shutil.move(f'{input_directory}\\{file}', f'{input_directory}\\Input\\{file}')
 
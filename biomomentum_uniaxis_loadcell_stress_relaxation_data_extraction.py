@@ -8,7 +8,8 @@ version: 0.1
 =========================================================
 How to use:
 1. Select the folder containing the input files.
-2. Repeat the process for the remaining samples, if needed.
+2. Choose whether to store the step-wise data in the compact format.
+3. Repeat the process for the remaining samples, if needed.
 =========================================================
 Notes:
 1. This code is meant to extract the stress-relaxation dataset when a uniaxis loadcell is used.
@@ -18,6 +19,13 @@ Notes:
 4. The stepwise stress-relaxation output files are in the form of multiple rows x 3 columns:
 -  The 1st column is the absolute position Z (mm), the 2nd column is force (n), and the 3rd column is time (s).
 5. The output files are saved as 2D numpy arrays
+6. A QC summary is saved per file, computed while the steps are being parsed, in the form of one row per step:
+-  step, rows, NaN count, min force (n), max force (n), time monotonic (1/0), sampling rate (Hz),
+-  terminated by <divider> (1/0), and OK (1/0).
+-  A step is not OK if it has NaN values, a non-monotonic time, or fewer rows than
+   the 101-point equilibrium window used by the input maker, or if its <divider> is missing.
+7. The step-wise output files can be saved in the compact format of biomomentum_compact_curve_storage (.npz),
+   they are read by its load_curve the same way as the text files.
 =========================================================
 TODO for version O.2
 1. Modify the code in a functional form.
@@ -25,95 +33,144 @@ TODO for version O.2
 =========================================================
 '''
 
-print(__doc__)
-
 import numpy as np
 import os
 import tkinter as tk
 from tkinter import filedialog
 import shutil
-
-root = tk.Tk()
-root.withdraw()
-
-condition = True
-while condition == True:
-
-    # Selecting the folder containing input dataset
-    input_directory = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the input directory')
-
-    # Listing all the inputs
-    input_files = sorted(os.listdir(input_directory), key=lambda x: int("".join([i for i in x if i.isdigit()])))
-
-    # Creating a folder to store the input files after processing
-    if not os.path.exists(f'{input_directory}\\Input'):
-        os.mkdir(f'{input_directory}\\Input')
-
-    # Creating a folder for the output files
-    if not os.path.exists(f'{input_directory}\\Output'):
-        os.mkdir(f'{input_directory}\\Output')
-
-    # Reading each file and extracting its stress relaxation data
-    for file in input_files:
-
-        # Creating a folder specific to Stress Relaxation output files:
-        if not os.path.exists(f'{input_directory}\\Output\\Stress-Relaxation'):
-            os.mkdir(f'{input_directory}\\Output\\Stress-Relaxation')
-
-        # Creating placeholders for the stress-relaxation data per file
-        stress_relaxation = []
-        stress_relaxation_flag = 0
-
-        # Extracting the stress relaxation bulk data
-        # <--> Reading everyting between <Stress Relaxation> and <End Data>
-        with open(f'{input_directory}\\{file}') as f:
-            for line in f:
-                if line.strip() == '<Stress Relaxation>':
-                    stress_relaxation_flag = 1
-                if stress_relaxation_flag == 1:
-                    stress_relaxation.append(line.strip())
-                if stress_relaxation_flag == 1 and line.strip() == '<END DATA>':
-                    stress_relaxation_flag = 0
-        # Cleansing the extracted data from its metadata information
-        tmp_sr_data = stress_relaxation[12:len(stress_relaxation)-1]
-
-        # Reading the stress relaxation data per its steps
-        step_count = 0 # creating a flag for steps
-        tmp_step_data = [] # Creating a placeholder for stepwise stress relaxation data
-        clean_comp_sr_data = [] # A placeholder for the bulk stress-relaxation data cleansed from in-line tags
-
-        for line in tmp_sr_data:
-
-            if line.strip() != '<divider>':
-                stripped_line = line.strip() # Reading the data
-                inner_list = stripped_line.split('\t')
-                tmp_step_data.append(inner_list) # appending the data to stepwise placeholder
-                clean_comp_sr_data.append(inner_list) # appending the data to the bulk placeholder
-            else:
-                step_count += 1 # Finishing the step
-                # Preparing the data to store as a numpy array
-                step_data = np.zeros((len(tmp_step_data), 3))
-                for i in range(len(tmp_step_data)):
-                    step_data[i][0] = float(tmp_step_data[i][1]) # Position x, mm
-                    # Reading and converting the force from g to n
-                    step_data[i][1] = np.abs(float(tmp_step_data[i][4]))*9.81*0.001
-                    step_data[i][2] = float(tmp_step_data[i][0]) # Time, s
-                np.savetxt(f'{input_directory}\\Output\\Stress-Relaxation\\{file[:-4]}-StressRelax-step{step_count}-UniAxisLoadCell.txt',
-                           step_data, delimiter='\t')
-                # Emptying the placeholder for the next step
-                tmp_step_data = []
-        # Storing the bulk stress-relaxation data for the sample
-        np.savetxt(f'{input_directory}\\Output\\Stress-Relaxation\\{file[:-4]}-StressRelaxation-UniAxisLoadCell.txt',
-                   np.array(clean_comp_sr_data, dtype='float'), delimiter='\t')
-        # Relocating the sample to the input folder
-        shutil.move(f'{input_directory}\\{file}', f'{input_directory}\\Input\\{file}')
+from biomomentum_compact_curve_storage import save_curve
+
+# Minimum number of rows per step, i.e., the equilibrium window averaged by the input maker
+equilibrium_window = 101
+
+# Header of the QC summary
+qc_header = 'step\trows\tnan_count\tforce_min\tforce_max\ttime_monotonic\tsampling_rate\tterminated\tok'
+
+
+def step_quality_control(step, step_data):
+    # Building the QC row of a single step from its (position, force, time) array
+    rows = len(step_data)
+    nan_count = int(np.count_nonzero(np.isnan(step_data)))
+    force_min = np.nanmin(step_data[:, 1]) if rows > 0 else np.nan
+    force_max = np.nanmax(step_data[:, 1]) if rows > 0 else np.nan
+    time_step = np.diff(step_data[:, 2])
+    time_monotonic = int(np.all(time_step > 0))
+    sampling_rate = 1/np.nanmedian(time_step) if rows > 1 and time_monotonic == 1 else np.nan
+    ok = int(nan_count == 0 and time_monotonic == 1 and rows >= equilibrium_window)
+    return [step, rows, nan_count, force_min, force_max, time_monotonic, sampling_rate, 1, ok]
+
+
+def extract_stress_relaxation(raw_file, output_directory, label, compact=False):
+    # Extracting the step-wise and bulk stress-relaxation data of a single raw file into the output directory
+    # Returns the paths of the stored step files and the QC summary of the steps
+
+    # Creating placeholders for the stress-relaxation data per file
+    stress_relaxation = []
+    stress_relaxation_flag = 0
+
+    # Extracting the stress relaxation bulk data
+    # <--> Reading everyting between <Stress Relaxation> and <End Data>
+    with open(raw_file) as f:
+        for line in f:
+            if line.strip() == '<Stress Relaxation>':
+                stress_relaxation_flag = 1
+            if stress_relaxation_flag == 1:
+                stress_relaxation.append(line.strip())
+            if stress_relaxation_flag == 1 and line.strip() == '<END DATA>':
+                stress_relaxation_flag = 0
+    # Cleansing the extracted data from its metadata information
+    tmp_sr_data = stress_relaxation[12:len(stress_relaxation)-1]
+
+    # Reading the stress relaxation data per its steps
+    step_count = 0 # creating a flag for steps
+    tmp_step_data = [] # Creating a placeholder for stepwise stress relaxation data
+    clean_comp_sr_data = [] # A placeholder for the bulk stress-relaxation data cleansed from in-line tags
+    qc_summary = [] # A placeholder for the QC summary of the steps
+    step_files = [] # A placeholder for the paths of the stored step files
+
+    for line in tmp_sr_data:
+
+        if line.strip() != '<divider>':
+            stripped_line = line.strip() # Reading the data
+            inner_list = stripped_line.split('\t')
+            tmp_step_data.append(inner_list) # appending the data to stepwise placeholder
+            clean_comp_sr_data.append(inner_list) # appending the data to the bulk placeholder
+        else:
+            step_count += 1 # Finishing the step
+            # Preparing the data to store as a numpy array
+            step_data = np.zeros((len(tmp_step_data), 3))
+            for i in range(len(tmp_step_data)):
+                step_data[i][0] = float(tmp_step_data[i][1]) # Position x, mm
+                # Reading and converting the force from g to n
+                step_data[i][1] = np.abs(float(tmp_step_data[i][4]))*9.81*0.001
+                step_data[i][2] = float(tmp_step_data[i][0]) # Time, s
+            step_file = os.path.join(output_directory, f'{label}-StressRelax-step{step_count}-UniAxisLoadCell.txt')
+            step_file = save_curve(step_file, step_data, compact)
+            step_files.append(step_file)
+            # Checking the quality of the step while its data is still in memory
+            qc_summary.append(step_quality_control(step_count, step_data))
+            # Emptying the placeholder for the next step
+            tmp_step_data = []
+    # Flagging the trailing rows whose <divider> is missing, these rows are not stored as a step
+    if len(tmp_step_data) > 0:
+        qc_summary.append([step_count+1, len(tmp_step_data), np.nan, np.nan, np.nan, np.nan, np.nan, 0, 0])
+    # Storing the QC summary for the sample
+    qc_summary = np.array(qc_summary, dtype='float').reshape(-1, 9)
+    np.savetxt(os.path.join(output_directory, f'{label}-StressRelax-QC-UniAxisLoadCell.txt'),
+               qc_summary, delimiter='\t', fmt='%g', header=qc_header)
+    # Storing the bulk stress-relaxation data for the sample
+    np.savetxt(os.path.join(output_directory, f'{label}-StressRelaxation-UniAxisLoadCell.txt'),
+               np.array(clean_comp_sr_data, dtype='float'), delimiter='\t')
+
+    return step_files, qc_summary
+
+
+if __name__ == '__main__':
+
+    print(__doc__)
+
+    root = tk.Tk()
+    root.withdraw()
+
+    condition = True
+    while condition == True:
+
+        # Selecting the folder containing input dataset
+        input_directory = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the input directory')
+
+        # Choosing the storage format of the step-wise output files
+        compact = input('Do you want to store the step-wise data in the compact format?(Y/N) --> ') == 'Y'
+
+        # Listing all the inputs
+        input_files = sorted(os.listdir(input_directory), key=lambda x: int("".join([i for i in x if i.isdigit()])))
+
+        # Creating a folder to store the input files after processing
+        if not os.path.exists(f'{input_directory}\\Input'):
+            os.mkdir(f'{input_directory}\\Input')
+
+        # Creating a folder for the output files
+        if not os.path.exists(f'{input_directory}\\Output'):
+            os.mkdir(f'{input_directory}\\Output')
+
+        # Reading each file and extracting its stress relaxation data
+        for file in input_files:
+
+            # Creating a folder specific to Stress Relaxation output files:
+            if not os.path.exists(f'{input_directory}\\Output\\Stress-Relaxation'):
+                os.mkdir(f'{input_directory}\\Output\\Stress-Relaxation')
+
+            # Extracting the stress-relaxation data of the sample
+            extract_stress_relaxation(f'{input_directory}\\{file}', f'{input_directory}\\Output\\Stress-Relaxation', file[:-4],
+                                      compact)
+            # Relocating the sample to the input folder
+            shutil.move(f'{input_directory}\\{file}', f'{input_directory}\\Input\\{file}')
 
 #   SETTING THE CONDITION FOR CONTINUING THE PROGRAM FOR OTHER PATELLAS
-    check = input('Do you want to continue?(Y/N) --> ')
-    if check == 'Y':
-        condition = True
-    elif check == 'N':
-        condition = False
-    else:
-        print('Wrong input --> Exiting...')
-        exit()
+        check = input('Do you want to continue?(Y/N) --> ')
+        if check == 'Y':
+            condition = True
+        elif check == 'N':
+            condition = False
+        else:
+            print('Wrong input --> Exiting...')
+            exit()
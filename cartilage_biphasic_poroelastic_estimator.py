@@ -0,0 +1,302 @@
+'''
+About: Python script to estimate the poroelastic properties of cartilage: matrix modulus, fibril modulus and permeability
+by fitting a fibril-reinforced biphasic model to the stress-relaxation curves
+from the output files of the Biomomentum Mach 1 micromechanical testing system.
+Author: Iman Kafian-Attari
+Date: 18.07.2021
+Licence: MIT
+version: 0.1
+=========================================================
+How to use:
+1. Select the output directory.
+2. Select the directory containing the step-wise stress-relaxation files of the samples.
+3. Input the radius of the indenter.
+4. Input the Poisson's value of the non-fibrillar matrix.
+5. Input the thickness of each listed sample, it is asked again if the number of thicknesses does not match.
+6. Repeat the process for the remaining samples, if needed.
+=========================================================
+Notes:
+1. This code is meant to estimate the poroelastic properties of articular cartilage from the full stress-relaxation curves.
+2. It requires the following inputs from the user:
+   - an output directory,
+   - an input directory with the step-wise stress-relaxation files saved by the extraction codes, as text or compact files,
+     the compact file of a step is used if its text file is kept as well,
+   - the radius of the used indenter,
+   - Poisson's value of the non-fibrillar matrix,
+   - the thickness of each sample.
+3. The forward model is the linear fibril-reinforced biphasic solution of unconfined compression (Soulhat et al. 1999),
+   which reduces to the linear isotropic biphasic solution (Armstrong et al. 1984) when the fibril modulus is zero.
+   - The tissue under the indenter is taken as a cylinder with the radius of the indenter.
+   - Each step is modelled as a linear strain ramp to the measured step strain, followed by a hold.
+   - The model is solved in the Laplace domain and inverted numerically with the fixed Talbot method,
+     vectorized over all the time points of a step.
+4. The steps of all the samples are fitted in parallel with non-linear least squares.
+   - The samples with a failed step in their QC summary saved by the extraction codes are skipped.
+   - A step that cannot be fitted, e.g., with no displacement, is stored as NaN and the other steps are still fitted.
+5. It stores the following data per step:
+   - strain of the step,
+   - ramp time (s),
+   - non-fibrillar matrix modulus (MPa),
+   - fibril network modulus (MPa),
+   - permeability (mm^4/(N s)),
+   - root mean squared error of the fit (MPa).
+6. The output files are saved as an Excel file
+=========================================================
+TODO for version O.2
+1. Use the measured displacement instead of an ideal ramp.
+2. Store the files as Pandas dataframes.
+=========================================================
+'''
+
+import numpy as np
+import os
+import re
+import math
+import tkinter as tk
+from tkinter import filedialog
+from concurrent.futures import ProcessPoolExecutor
+from scipy import optimize, special
+import xlwt
+from biomomentum_compact_curve_storage import compact_extension, load_curve
+
+# Number of nodes on the Talbot contour used for the numerical inversion of the Laplace transform
+talbot_nodes = 24
+
+# Number of log-spaced time points of each step used for fitting
+fit_points = 200
+
+# Parameters estimated per step
+parameter_header = ['Step strain', 'Ramp time (s)', 'Matrix mod (MPa)', 'Fibril mod (MPa)', 'Permeability (mm^4/Ns)',
+                    'RMSE (MPa)']
+
+# Bounds of the fitted parameters as log10 of matrix mod (MPa), fibril mod (MPa) and permeability (mm^4/Ns)
+log_bounds = ([-4, -4, -8], [4, 4, 2])
+
+
+def talbot_inversion(laplace_function, t):
+    # Inverting a Laplace transform at the times t (> 0) with the fixed Talbot method (Abate & Valko 2004)
+    t = np.atleast_1d(t).astype(float)[:, None]
+    k = np.arange(1, talbot_nodes)
+    theta = k * np.pi / talbot_nodes
+    cot = 1 / np.tan(theta)
+    r = 2 * talbot_nodes / (5 * t)
+
+    s = np.concatenate([r + 0j, r * theta * (cot + 1j)], axis=1)
+    sigma = np.concatenate([np.zeros(1), theta + (theta*cot - 1)*cot])
+    weights = np.exp(s * t) * (1 + 1j*sigma)
+    weights[:, 0] *= 0.5
+
+    return (r[:, 0] / talbot_nodes) * np.real(np.sum(weights * laplace_function(s), axis=1))
+
+
+def relaxation_transfer(s, radius, matrix_mod, fibril_mod, permeability, poisson):
+    # Average axial stress over strain of the fibril-reinforced biphasic cylinder in the Laplace domain
+    lame_lambda = matrix_mod * poisson / ((1 + poisson) * (1 - 2*poisson))
+    lame_mu = matrix_mod / (2 * (1 + poisson))
+    radial_mod = lame_lambda + 2*lame_mu + fibril_mod # Radial stiffness of the matrix and the fibrils
+    shear_mod = radial_mod - lame_lambda
+
+    # Dimensionless radius: a*sqrt(s/(k*H)), the Bessel ratio I1(x)/(x*I0(x)) is scaled to avoid overflow
+    x = radius * np.sqrt(s / (permeability * radial_mod))
+    bessel_ratio = special.ive(1, x) / (x * special.ive(0, x))
+
+    return 2*lame_mu + 0.5 * shear_mod * (radial_mod - 2*shear_mod*bessel_ratio) / (radial_mod - shear_mod*bessel_ratio)
+
+
+def ramp_relaxation_stress(t, ramp_time, strain, radius, matrix_mod, fibril_mod, permeability, poisson):
+    # Average axial stress (MPa) of a linear strain ramp to the given strain in ramp_time seconds, followed by a hold
+    # The ramp is a superposition of two shifted integrals of the step response: L^-1[G(s)/s^2]
+    def ramp_integral(s):
+        return relaxation_transfer(s, radius, matrix_mod, fibril_mod, permeability, poisson) / (s*s)
+
+    t = np.asarray(t, dtype=float)
+    stress = np.zeros(len(t))
+    loading = t > 0
+    stress[loading] = talbot_inversion(ramp_integral, t[loading])
+    holding = t > ramp_time
+    stress[holding] -= talbot_inversion(ramp_integral, t[holding] - ramp_time)
+
+    return stress * strain / ramp_time
+
+
+def read_step_curve(step_file, thickness, first_position, radius):
+    # Reading a step-wise stress-relaxation file as the time, stress increment, strain and ramp time of the step
+    step_data = load_curve(step_file)
+    step_data = step_data[~np.isnan(step_data).any(axis=1)]
+    displacement = np.abs(step_data[:, 0] - step_data[0, 0])
+
+    # The thickness at the beginning of the step, compressed by the previous steps
+    step_thickness = thickness - np.abs(step_data[0, 0] - first_position)
+    step_displacement = np.nanmean(displacement[len(displacement)-101:])
+    strain = step_displacement / step_thickness
+
+    # The ramp starts at the last point before the indenter moves by 1% of the step's displacement,
+    # and ends when the displacement reaches 99% of the step's displacement
+    ramp_start = np.argmax(displacement > 0.01 * step_displacement) - 1
+    ramp_start = max(ramp_start, 0)
+    ramp_end = np.argmax(displacement >= 0.99 * step_displacement)
+    time = step_data[:, 2] - step_data[ramp_start, 2]
+    ramp_time = max(time[ramp_end], time[ramp_start+1])
+
+    # Stress increment of the step, relative to the force before the ramp
+    stress = (step_data[:, 1] - np.nanmean(step_data[0:ramp_start+1, 1])) / (math.pi * radius * radius)
+    return time[ramp_start:], stress[ramp_start:], strain, ramp_time
+
+
+def fit_step(step_file, thickness, first_position, radius, poisson):
+    # Fitting the fibril-reinforced biphasic model to a single step, returns the parameters in parameter_header order
+    # A step that cannot be fitted returns NaN parameters, so that the other steps of the batch are kept
+    try:
+        return fit_step_curve(step_file, thickness, first_position, radius, poisson)
+    except Exception as error:
+        print(f'Fitting {os.path.basename(step_file)} failed --> {error}')
+        return [np.nan]*len(parameter_header)
+
+
+def fit_step_curve(step_file, thickness, first_position, radius, poisson):
+    # Fitting a single step, raises a ValueError if the step has no usable strain or stress
+    time, stress, strain, ramp_time = read_step_curve(step_file, thickness, first_position, radius)
+    if not (np.isfinite(strain) and strain > 0 and np.isfinite(ramp_time) and ramp_time > 0):
+        raise ValueError(f'no usable strain ({strain}) or ramp time ({ramp_time})')
+    if len(time) < 3 or not np.all(np.isfinite(stress)):
+        raise ValueError('no usable stress curve')
+
+    # Log-spaced time points, dense during the ramp and the fast relaxation
+    fit_time = np.unique(np.geomspace(time[1], time[-1], fit_points))
+    fit_stress = np.interp(fit_time, time, stress)
+
+    # Initial guesses from the equilibrium and peak stresses
+    equ_mod = max(np.nanmean(stress[len(stress)-101:]) / strain, 1e-3)
+    peak_mod = max(np.amax(stress) / strain, equ_mod)
+    initial = np.log10([equ_mod, max(2*(peak_mod - 1.5*equ_mod/(1 + poisson)), equ_mod), 1e-3])
+    initial = np.clip(initial, log_bounds[0], log_bounds[1])
+
+    def residuals(log_parameters):
+        matrix_mod, fibril_mod, permeability = np.power(10, log_parameters)
+        return ramp_relaxation_stress(fit_time, ramp_time, strain, radius, matrix_mod, fibril_mod, permeability,
+                                      poisson) - fit_stress
+
+    result = optimize.least_squares(residuals, initial, bounds=log_bounds, x_scale=1.0)
+    matrix_mod, fibril_mod, permeability = np.power(10, result.x)
+    rmse = np.sqrt(np.mean(result.fun**2))
+
+    return [strain, ramp_time, matrix_mod, fibril_mod, permeability, rmse]
+
+
+def fit_biphasic_samples(samples, radius, poisson, workers=None):
+    # Fitting all the steps of all the samples in parallel
+    # samples is a dict of label --> (step files ordered by step, thickness in mm), workers=None uses all the cores
+    # Returns a dict of label --> 2D array of the fitted parameters (parameters x steps)
+    tasks = []
+    for label, (step_files, thickness) in samples.items():
+        try:
+            first_position = load_curve(step_files[0])[0][0]
+        except Exception:
+            first_position = np.nan # The steps of the sample are then returned as NaN by fit_step
+        for step_file in step_files:
+            tasks.append((label, step_file, thickness, first_position))
+
+    arguments = ([task[1] for task in tasks], [task[2] for task in tasks], [task[3] for task in tasks],
+                 [radius]*len(tasks), [poisson]*len(tasks))
+    if workers == 1:
+        # Fitting in the calling process, e.g., when it is already one of many parallel workers
+        fits = list(map(fit_step, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fits = list(executor.map(fit_step, *arguments))
+
+    results = {label: [] for label in samples}
+    for task, fit in zip(tasks, fits):
+        results[task[0]].append(fit)
+    return {label: np.array(fit).T for label, fit in results.items()}
+
+
+def save_biphasic_fit(fit_data, output_file):
+    # Storing the fitted poroelastic parameters of a single sample into an excel file
+    biphasic = xlwt.Workbook()
+
+    final_fit_data = biphasic.add_sheet('Biphasic Fit')
+    final_fit_data.write(0, 0, 'Data')
+    for i in range(fit_data.shape[1]):
+        final_fit_data.write(0, i+1, f'Step {i}')
+
+    for label in range(len(parameter_header)):
+        final_fit_data.write(label+1, 0, parameter_header[label])
+    for i in range(fit_data.shape[1]):
+        for j in range(len(parameter_header)):
+            if not np.isnan(fit_data[j][i]):
+                final_fit_data.write(j+1, i+1, fit_data[j][i])
+
+    biphasic.save(output_file)
+
+
+def list_step_files(input_dir):
+    # Grouping the step-wise stress-relaxation files per sample label, ordered by step
+    # A step converted to the compact format while keeping its text file is listed once, as its compact file
+    samples = {}
+    for file in sorted(os.listdir(input_dir)):
+        match = re.match(r'(.+)-StressRelax-step(\d+)-.*(\.txt|\.npz)$', file)
+        if match:
+            steps = samples.setdefault(match.group(1), {})
+            if int(match.group(2)) not in steps or match.group(3) == compact_extension:
+                steps[int(match.group(2))] = os.path.join(input_dir, file)
+    return {label: [steps[step] for step in sorted(steps)] for label, steps in sorted(samples.items())}
+
+
+def failed_qc_steps(input_dir, label):
+    # Listing the steps of a sample that failed the QC summary saved by the extraction codes, if there is one
+    failed = []
+    for file in os.listdir(input_dir):
+        if file.startswith(f'{label}-StressRelax-QC-'):
+            qc_summary = np.loadtxt(os.path.join(input_dir, file), ndmin=2)
+            failed += [int(row[0]) for row in qc_summary if row[8] == 0]
+    return failed
+
+
+if __name__ == '__main__':
+
+    print(__doc__)
+
+    root = tk.Tk()
+    root.withdraw()
+
+    condition = True
+    while condition == True:
+
+        # Reading the input and output directories
+        output_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the output directory')
+        input_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the step-wise stress-relaxation directory')
+
+        # Listing the samples and their step files
+        step_files = list_step_files(input_dir)
+
+        # Skipping the samples with failed steps in their QC summary
+        for label in list(step_files):
+            failed = failed_qc_steps(input_dir, label)
+            if len(failed) > 0:
+                print(f'Skipping {label} --> steps {failed} failed QC')
+                del step_files[label]
+        print('Samples found --> ' + ', '.join(step_files))
+
+        # Reading infromation required for fitting the biphasic model
+        radius = float(input('Insert the radius of the indenter (mm) --> ')) # The radius of the indenter
+        poisson = float(input('Insert the Poisson\'s value of the non-fibrillar matrix --> ')) # The Poisson's value of the matrix
+        # The thicknesses are matched to the listed samples by their order, so one is needed per listed sample
+        thicknesses = input('List the samples\' thicknesses (mm) in the same order, separate them with a comma (,) --> ').split(',')
+        while len(step_files) > 0 and len(thicknesses) != len(step_files):
+            print(f'Wrong input --> {len(thicknesses)} thicknesses given for {len(step_files)} samples')
+            thicknesses = input('List the samples\' thicknesses (mm) in the same order, separate them with a comma (,) --> ').split(',')
+
+        samples = {label: (files, float(thickness)) for (label, files), thickness in zip(step_files.items(), thicknesses)}
+        fits = fit_biphasic_samples(samples, radius, poisson)
+        for label, fit_data in fits.items():
+            save_biphasic_fit(fit_data, os.path.join(output_dir, f'{label}-BiphasicModuli.xls'))
+
+        check = input('Do you want to continue?(Y/N) --> ')
+        if check == 'Y':
+            condition = True
+        elif check == 'N':
+            condition = False
+        else:
+            print('Wrong input --> Exiting...')
+            exit()
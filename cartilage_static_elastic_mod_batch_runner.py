@@ -0,0 +1,329 @@
+'''
+About: Python script to run the whole static elastic moduli pipeline: extraction, input making and estimation
+for a large archive of output files of the Biomomentum Mach 1 micromechanical testing system on many machines.
+Author: Iman Kafian-Attari
+Date: 18.07.2021
+Licence: MIT
+version: 0.1
+=========================================================
+How to use:
+1. Write a manifest file with one row per raw file, separate the columns with a tab:
+   - the path of the raw file,
+   - the sample's thickness in mm,
+   - the list of strains used in the experiment, separated with comma (,).
+2. Add the raw files to a queue directory on a filesystem shared by all the machines:
+   python cartilage_static_elastic_mod_batch_runner.py enqueue <queue> <manifest> --radius 0.5 --poisson-eq 0.1 --poisson-inst 0.5
+3. Start the workers on each machine, as many times as needed:
+   python cartilage_static_elastic_mod_batch_runner.py work <queue> --workers 8
+4. Check the progress of the queue:
+   python cartilage_static_elastic_mod_batch_runner.py status <queue>
+=========================================================
+Notes:
+1. This code is meant to process the stress-relaxation dataset of many samples without any scheduler service.
+2. A work unit is one raw file through extraction, input making and estimation.
+   The unit is named <raw file name>-<8 hex digits of the hash of its absolute path>,
+   so the raw files with the same name in different folders are different units.
+3. The queue directory holds one small text file per work unit in one of the following folders:
+   - pending: units waiting for a worker,
+   - running: units claimed by a worker, the file is renamed to <unit>--<worker>,
+   - done: units processed successfully,
+   - flagged: units skipped after extraction since their QC summary failed,
+   - failed: units whose processing raised an error, the error is appended to the unit file.
+4. A unit is claimed with an atomic rename from pending to running, so only one worker gets it.
+5. The worker touches its running unit file as a heartbeat, and any worker returns the units
+   whose heartbeat is older than the timeout back to pending, i.e., the units of crashed workers.
+   The timeout must be much longer than the heartbeat interval and the clock skew between the machines.
+   The reclaims are counted in the unit file, and a unit reclaimed --max-reclaims times is moved to failed.
+6. The progress is stored in the queue directory itself, so stopped workers can be restarted at any time.
+7. The output files of each unit are saved in <queue>/Output/<unit>:
+   - the step-wise and bulk stress-relaxation files and their QC summary,
+     the step-wise files are saved in the compact format if the workers are started with --compact,
+   - the input file for the estimator,
+   - the estimated moduli as an Excel file,
+   - the fitted biphasic parameters as an Excel file, if the workers are started with --biphasic.
+=========================================================
+TODO for version O.2
+1. Store the files as Pandas dataframes.
+=========================================================
+'''
+
+import numpy as np
+import os
+import argparse
+import hashlib
+import multiprocessing
+import socket
+import threading
+import time
+import traceback
+import biomomentum_multiaxis_loadcell_stress_relaxation_data_extraction as multiaxis_extraction
+import biomomentum_uniaxis_loadcell_stress_relaxation_data_extraction as uniaxis_extraction
+from cartilage_static_elastic_mod_input_maker import make_mod_input
+from cartilage_static_elastic_mod_estimator import estimate_static_moduli, save_static_moduli
+from cartilage_biphasic_poroelastic_estimator import fit_biphasic_samples, save_biphasic_fit
+
+# Folders of the queue directory per state of the work units
+queue_states = ['pending', 'running', 'done', 'flagged', 'failed']
+
+# Extraction per type of the used loadcell
+extractors = {'multiaxis': multiaxis_extraction, 'uniaxis': uniaxis_extraction}
+
+
+def make_queue(queue_directory):
+    # Creating the folders of the queue directory
+    for state in queue_states + ['Output']:
+        os.makedirs(os.path.join(queue_directory, state), exist_ok=True)
+
+
+def queued_units(queue_directory):
+    # Listing the names of all the units in the queue, whatever their state
+    units = set()
+    for state in queue_states:
+        for name in os.listdir(os.path.join(queue_directory, state)):
+            units.add(name.rsplit('--', 1)[0] if state == 'running' else name)
+    return units
+
+
+def unit_name_of(raw_file):
+    # Naming the unit of a raw file after its name and a short hash of its absolute path
+    raw_file = os.path.abspath(raw_file)
+    path_hash = hashlib.sha1(raw_file.encode('utf-8')).hexdigest()[:8]
+    return f'{os.path.splitext(os.path.basename(raw_file))[0]}-{path_hash}'
+
+
+def read_unit(unit_file):
+    # Reading the parameters of a work unit stored as key-value rows
+    unit = {}
+    with open(unit_file) as f:
+        for line in f:
+            key, value = line.rstrip('\n').split('\t', 1)
+            unit[key] = value
+    return unit
+
+
+def enqueue(queue_directory, manifest, radius, poisson_eq, poisson_inst, loadcell):
+    # Adding the raw files of the manifest to the queue, the units already in the queue are kept as they are
+    make_queue(queue_directory)
+    units = queued_units(queue_directory)
+    added = 0
+    with open(manifest) as f:
+        for line in f:
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            raw_file, thickness, strains = line.strip().split('\t')
+            unit_name = unit_name_of(raw_file)
+            if unit_name in units:
+                continue
+
+            unit = {'raw_file': os.path.abspath(raw_file), 'thickness': thickness, 'strains': strains,
+                    'radius': radius, 'poisson_eq': poisson_eq, 'poisson_inst': poisson_inst, 'loadcell': loadcell}
+            # Writing the unit aside and renaming it, so that no worker claims a half-written unit
+            tmp_file = os.path.join(queue_directory, f'.{unit_name}.tmp')
+            with open(tmp_file, 'w') as unit_file:
+                for key, value in unit.items():
+                    unit_file.write(f'{key}\t{value}\n')
+            os.rename(tmp_file, os.path.join(queue_directory, 'pending', unit_name))
+            units.add(unit_name)
+            added += 1
+    return added
+
+
+def claim_unit(queue_directory, worker_id):
+    # Claiming the first pending unit by renaming it into running, None if there is nothing left to claim
+    for unit_name in sorted(os.listdir(os.path.join(queue_directory, 'pending'))):
+        pending_file = os.path.join(queue_directory, 'pending', unit_name)
+        claimed_file = os.path.join(queue_directory, 'running', f'{unit_name}--{worker_id}')
+        try:
+            # Touching the unit first, so that it is not taken as stale as soon as it is renamed
+            os.utime(pending_file)
+            os.rename(pending_file, claimed_file)
+        except FileNotFoundError:
+            continue # Claimed by another worker in the meantime
+        return unit_name, claimed_file
+    return None
+
+
+def append_to_unit(unit_file, text):
+    # Appending to an existing unit file, raises FileNotFoundError instead of creating it if it was moved meanwhile
+    f = os.open(unit_file, os.O_WRONLY | os.O_APPEND)
+    try:
+        os.write(f, text.encode())
+    finally:
+        os.close(f)
+
+
+def reclaim_stale_units(queue_directory, timeout, max_reclaims=3):
+    # Returning the running units without a recent heartbeat back to pending
+    # A unit reclaimed max_reclaims times is moved to failed, since its raw file may be the one crashing the workers
+    reclaimed = 0
+    reclaimer_id = f'reclaim-{socket.gethostname()}-{os.getpid()}'
+    for name in os.listdir(os.path.join(queue_directory, 'running')):
+        claimed_file = os.path.join(queue_directory, 'running', name)
+        unit_name = name.rsplit('--', 1)[0]
+        reclaiming_file = os.path.join(queue_directory, 'running', f'{unit_name}--{reclaimer_id}')
+        try:
+            if time.time() - os.path.getmtime(claimed_file) < timeout:
+                continue
+            # Taking the unit over first, so that only this worker counts the reclaim
+            os.rename(claimed_file, reclaiming_file)
+            os.utime(reclaiming_file)
+            reclaims = int(read_unit(reclaiming_file).get('reclaims', 0)) + 1
+            note = f'reclaims\t{reclaims}\n'
+            if reclaims >= max_reclaims:
+                note += f'failed\treclaimed {reclaims} times, its worker may have crashed on it\n'
+            append_to_unit(reclaiming_file, note)
+            state = 'failed' if reclaims >= max_reclaims else 'pending'
+            os.rename(reclaiming_file, os.path.join(queue_directory, state, unit_name))
+        except FileNotFoundError:
+            continue # Finished or reclaimed by another worker in the meantime
+        reclaimed += 1
+    return reclaimed
+
+
+def heartbeat(claimed_file, interval, stop):
+    # Touching the claimed unit file until the unit is finished or reclaimed
+    while not stop.wait(interval):
+        try:
+            os.utime(claimed_file)
+        except FileNotFoundError:
+            return
+
+
+def qc_problems(qc_summary, n_steps, max_force):
+    # Listing the problems found in the QC summary of the steps used by the input maker
+    problems = []
+    if len(qc_summary) < n_steps:
+        problems.append(f'{len(qc_summary)} steps found, {n_steps} strains given')
+    for row in qc_summary[:n_steps]:
+        if row[8] == 0:
+            problems.append(f'step {int(row[0])} failed QC')
+        if max_force is not None and row[4] >= max_force:
+            problems.append(f'step {int(row[0])} reached the force limit')
+    return problems
+
+
+def process_unit(unit, unit_name, output_directory, max_force=None, biphasic=False, compact=False):
+    # Running a single raw file through extraction, input making and estimation
+    # Returns the QC problems of the unit, the later stages are skipped if there is any
+    os.makedirs(output_directory, exist_ok=True)
+    strains = unit['strains'].split(',')
+
+    step_files, qc_summary = extractors[unit['loadcell']].extract_stress_relaxation(
+        unit['raw_file'], output_directory, unit_name, compact)
+    problems = qc_problems(qc_summary, len(strains), max_force)
+    if len(problems) > 0:
+        return problems
+
+    mod_input_data = make_mod_input(step_files, float(unit['thickness']), strains)
+    np.savetxt(os.path.join(output_directory, f'{unit_name}-StaticElasticMod-Input.txt'), mod_input_data, delimiter='\t')
+
+    equ_mod_data, inst_mod_data = estimate_static_moduli(
+        mod_input_data, float(unit['radius']), float(unit['poisson_eq']), float(unit['poisson_inst']))
+    save_static_moduli(equ_mod_data, inst_mod_data, os.path.join(output_directory, f'{unit_name}-StaticElasticModuli.xls'))
+
+    if biphasic:
+        # Fitting the steps in this worker, the units are already processed in parallel
+        fits = fit_biphasic_samples({unit_name: (step_files[:len(strains)], float(unit['thickness']))},
+                                    float(unit['radius']), float(unit['poisson_eq']), workers=1)
+        save_biphasic_fit(fits[unit_name], os.path.join(output_directory, f'{unit_name}-BiphasicModuli.xls'))
+    return []
+
+
+def finish_unit(queue_directory, unit_name, claimed_file, state, note=None):
+    # Moving the claimed unit into its final state, the result is dropped if the unit was reclaimed meanwhile
+    # Renaming first, so that the note is never written into a unit file another worker has taken over
+    finished_file = os.path.join(queue_directory, state, unit_name)
+    try:
+        os.rename(claimed_file, finished_file)
+    except FileNotFoundError:
+        return False
+    if note is not None:
+        append_to_unit(finished_file, f'{state}\t{note}\n')
+    return True
+
+
+def work(queue_directory, timeout=600, poll=10, max_force=None, biphasic=False, compact=False, max_reclaims=3):
+    # Processing the units of the queue until there is no pending or running unit left
+    make_queue(queue_directory)
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    processed = 0
+
+    while True:
+        reclaim_stale_units(queue_directory, timeout, max_reclaims)
+        claimed = claim_unit(queue_directory, worker_id)
+        if claimed is None:
+            # Waiting for the running units of the other workers, they return to pending if their worker crashes
+            if len(os.listdir(os.path.join(queue_directory, 'running'))) == 0:
+                return processed
+            time.sleep(poll)
+            continue
+
+        unit_name, claimed_file = claimed
+        stop = threading.Event()
+        beat = threading.Thread(target=heartbeat, args=(claimed_file, timeout/10, stop), daemon=True)
+        beat.start()
+        try:
+            problems = process_unit(read_unit(claimed_file), unit_name,
+                                    os.path.join(queue_directory, 'Output', unit_name), max_force, biphasic, compact)
+            if len(problems) > 0:
+                state, note = 'flagged', '; '.join(problems)
+            else:
+                state, note = 'done', None
+        except Exception:
+            state, note = 'failed', traceback.format_exc().strip().replace('\n', ' | ')
+        finally:
+            stop.set()
+            beat.join()
+
+        if finish_unit(queue_directory, unit_name, claimed_file, state, note):
+            processed += 1
+            print(f'{worker_id}: {unit_name} --> {state}')
+
+
+def status(queue_directory):
+    # Counting the units per state
+    return {state: len(os.listdir(os.path.join(queue_directory, state))) for state in queue_states}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Batch runner of the static elastic moduli pipeline.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = commands.add_parser('enqueue', help='Add the raw files of a manifest to the queue.')
+    enqueue_parser.add_argument('queue', help='The queue directory on the shared filesystem.')
+    enqueue_parser.add_argument('manifest', help='Rows of raw file, thickness (mm) and strains, separated with tab.')
+    enqueue_parser.add_argument('--radius', type=float, required=True, help='The radius of the indenter (mm).')
+    enqueue_parser.add_argument('--poisson-eq', type=float, required=True, help='The Poisson\'s value at equilibrium.')
+    enqueue_parser.add_argument('--poisson-inst', type=float, required=True, help='The Poisson\'s value at instantaneous.')
+    enqueue_parser.add_argument('--loadcell', choices=sorted(extractors), default='multiaxis', help='The used loadcell.')
+
+    work_parser = commands.add_parser('work', help='Process the queue until it is empty.')
+    work_parser.add_argument('queue', help='The queue directory on the shared filesystem.')
+    work_parser.add_argument('--workers', type=int, default=1, help='The number of worker processes on this machine.')
+    work_parser.add_argument('--timeout', type=float, default=600, help='Seconds without heartbeat to reclaim a unit.')
+    work_parser.add_argument('--max-reclaims', type=int, default=3, help='Reclaims of a unit before it is failed.')
+    work_parser.add_argument('--poll', type=float, default=10, help='Seconds between the checks of an empty queue.')
+    work_parser.add_argument('--max-force', type=float, default=None, help='The force limit of the loadcell (n).')
+    work_parser.add_argument('--biphasic', action='store_true', help='Fit the biphasic model to the steps as well.')
+    work_parser.add_argument('--compact', action='store_true', help='Store the step-wise data in the compact format.')
+
+    status_parser = commands.add_parser('status', help='Count the units per state.')
+    status_parser.add_argument('queue', help='The queue directory on the shared filesystem.')
+
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        added = enqueue(args.queue, args.manifest, args.radius, args.poisson_eq, args.poisson_inst, args.loadcell)
+        print(f'{added} units added to the queue')
+    elif args.command == 'work':
+        worker_args = (args.queue, args.timeout, args.poll, args.max_force, args.biphasic, args.compact,
+                       args.max_reclaims)
+        workers = [multiprocessing.Process(target=work, args=worker_args) for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        for state, count in status(args.queue).items():
+            print(f'{state}: {count}')
@@ -12,6 +12,8 @@ How to use:
 3. Input the radius of the indenter.
 4. Input the Poisson's value at equilibrium.
 5. Input the Poisson's value at instantaneous.
+6. Choose the indentation-map mode, if the input files are the test locations of indentation mapping.
+7. In the indentation-map mode, input the resolution of the interpolated surface maps, 0 for no surface map.
 =========================================================
 Notes:
 1. This code is meant to estimate the elastic instantaneous and equilibrium moduli for articular cartilage.
@@ -41,6 +43,15 @@ Notes:
    - Crt stepwise inst,
    - Crt fitted inst.
 5. The output files are saved as an Excel file
+6. In the indentation-map mode:
+   - the labels of the input files must hold the sample and the location coordinates (mm) as <sample>-x<X>-y<Y>,
+     e.g., Patella1-x2.5-y-1.0-StaticElasticMod-Input.txt,
+   - all the locations of a sample are stacked and estimated at once,
+   - a location x modulus grid is saved per sample as an Excel file and a 2D numpy array with the columns:
+     x, y, Crt fitted equ, Crt fitted inst, Crt stepwise equ per step, Crt stepwise inst per step,
+   - the interpolated surface maps of the Crt fitted equ and inst moduli are saved as 2D numpy arrays,
+     the 1st row holds the x coordinates and the 1st column holds the y coordinates.
+     The locations with a NaN modulus are left out, and the nearest location is used if the locations lie on a line.
 =========================================================
 TODO for version O.2
 1. Modify the code in a functional form.
@@ -48,17 +59,15 @@ TODO for version O.2
 =========================================================
 '''
 
-print(__doc__)
-
 import numpy as np
 import os
 import tkinter as tk
 from tkinter import filedialog
 import shutil
 import math
+import re
 from openpyxl import Workbook
 from scipy import interpolate
-from numpy import polyfit as fit
 import xlrd, xlwt
 
 # Setting up some mechanical parameters for Hayes' correction formula
@@ -68,112 +77,241 @@ poisson_equ_vals = np.array([1.183, 1.434, 1.677, 1.963, 2.260, 2.564, 2.872, 3.
 inst_k_interpolating = interpolate.interp1d(points, poisson_inst_vals, kind='cubic', fill_value='extrapolate')
 equ_k_interpolating = interpolate.interp1d(points, poisson_equ_vals, kind='cubic', fill_value='extrapolate')
 
-root = tk.Tk()
-root.withdraw()
+# Labels of the input files in the indentation-map mode: <sample>-x<X>-y<Y>
+location_pattern = re.compile(r'(?P<sample>.+?)[-_]x(?P<x>-?\d+(?:\.\d+)?)[-_]y(?P<y>-?\d+(?:\.\d+)?)')
+
+
+def fitted_slope(strains, stresses):
+    # Slope of the line fitted to the stresses and strains of each location, NaN steps are ignored
+    # A location with fewer than 2 valid steps, or with a single strain, has no slope and gets NaN
+    valid = ~(np.isnan(strains) | np.isnan(stresses))
+    count = np.sum(valid, axis=-1)
+    strains = np.where(valid, strains, 0)
+    stresses = np.where(valid, stresses, 0)
+    strain_mean = np.sum(strains, axis=-1) / np.maximum(count, 1)
+    stress_mean = np.sum(stresses, axis=-1) / np.maximum(count, 1)
+    covariance = np.sum(valid * (strains - strain_mean[:, None]) * (stresses - stress_mean[:, None]), axis=-1)
+    variance = np.sum(valid * (strains - strain_mean[:, None])**2, axis=-1)
+    fitted = (count >= 2) & (variance > 0)
+    return np.divide(covariance, variance, out=np.full(len(count), np.nan), where=fitted)
+
+
+def estimate_static_moduli_batch(input_stack, radius, poisson_eq, poisson_inst):
+    # Estimating the Hayes' corrected equilibrium and instantaneous moduli of many locations at once
+    # input_stack is a 3D array of input data (locations x 8 x steps), the steps missing at a location are NaN
+    # Returns two 3D arrays of the equilibrium and instantaneous moduli data (locations x 7 x steps)
+
+    # Equilibrium Modulus
+    equ_mod_data = np.zeros((input_stack.shape[0], 7, input_stack.shape[2]))
+
+    # Preliminary data required for estimating the Hayes' corrected equilibrium modulus.
+    equ_mod_data[:, 0] = radius/input_stack[:, 0] # Hayes' ratio (a/h), a = radius of indenter = 1/2
+    equ_mod_data[:, 1] = equ_k_interpolating(equ_mod_data[:, 0]) # Equilibrium kappa for Hayes' correction
+    equ_mod_data[:, 2] = input_stack[:, 4]/ (math.pi*radius*radius) # Equilibrium stress
+    equ_mod_data[:, 3] = equ_mod_data[:, 2]/input_stack[:, 2] # Step-wise init. Equilibrium mod.
+
+    # Corrected equ.
+    # Init. equ. mod based on fitted line to equ. stresses and strains
+    equ_mod_data[:, 4] = fitted_slope(input_stack[:, 1], equ_mod_data[:, 2])[:, None]
+
+    # Corrected step-wise equ. mod. for the step-wise init. equ. mod.
+    equ_mod_data[:, 5] = ((1 - pow(poisson_eq, 2)) * math.pi * equ_mod_data[:, 0] * (
+            equ_mod_data[:, 2]/input_stack[:, 1])) / (2 * equ_mod_data[:, 1])
+
+    equ_mod_data[:, 6] = ((1 - pow(poisson_eq, 2)) * math.pi * equ_mod_data[:, 0, :1] * equ_mod_data[:, 4]) / (
+            2 * equ_mod_data[:, 1, :1]) # Corrected fitted equ. mod. for the fitted init. equ. mod.
+
+    # Instantaneous Modulus
+    inst_mod_data = np.zeros((input_stack.shape[0], 7, input_stack.shape[2]))
+
+    # Preliminary data required for estimating the Hayes' corrected instantaneous modulus.
+    inst_mod_data[:, 0] = radius/input_stack[:, 0]  # Hayes' ratio (a/h)
+    inst_mod_data[:, 1] = inst_k_interpolating(inst_mod_data[:, 0]) # Inst. kappa for Hayes' correction
+    inst_mod_data[:, 2] = input_stack[:, 7] / (math.pi * radius * radius)  # inst. stress
+    inst_mod_data[:, 3] = inst_mod_data[:, 2] / input_stack[:, 2]  # Step-wise init. inst. mod.
+
+    # Corrected Inst.
+    # Init. inst. mod based on fitted line to inst. stresses and strains
+    inst_mod_data[:, 4] = fitted_slope(input_stack[:, 1], inst_mod_data[:, 2])[:, None]
 
-condition = True
-while condition == True:
+    # Corrected step-wise inst. mod. for the step-wise init. inst. mod.
+    inst_mod_data[:, 5] = ((1 - pow(poisson_inst, 2)) * math.pi * inst_mod_data[:, 0] * (inst_mod_data[:, 2]/input_stack[:, 1])) / (
+                2 * inst_mod_data[:, 1])
 
-    # Reading the input and output directories
-    output_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the output directory')
-    input_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the input directory')
+    # Corrected fitted inst. mod. for the fitted init. inst. mod.
+    inst_mod_data[:, 6] = ((1 - pow(poisson_inst, 2)) * math.pi * inst_mod_data[:, 0, :1] * inst_mod_data[:, 4]) / (
+                2 * inst_mod_data[:, 1, :1])
 
-    # Listing all the input files ready for the estimator
-    input_files = os.listdir(input_dir)
-    file_list = sorted(input_files, key=lambda x: int("".join([i for i in x if i.isdigit()])))
+    return equ_mod_data, inst_mod_data
 
-    # Reading infromation required for estimating the elastic moduli
-    radius = float(input('Inser the radius of the indenter (mm) --> ')) # The radius of the indenter
-    poisson_eq = float(input('Inser the Poisson\'s value for equilibrium modulus --> ')) # The Poisson's value at equilibrium
-    poisson_inst = float(input('Inser the Poisson\'s value for instantaneous modulus --> ')) # The Poisson's value at instantaneous
 
+def estimate_static_moduli(input_data, radius, poisson_eq, poisson_inst):
+    # Estimating the Hayes' corrected equilibrium and instantaneous moduli of a single sample from its input data
+    equ_mod_data, inst_mod_data = estimate_static_moduli_batch(input_data[None], radius, poisson_eq, poisson_inst)
+    return equ_mod_data[0], inst_mod_data[0]
+
+
+def save_static_moduli(equ_mod_data, inst_mod_data, output_file):
+    # Storing the estimated equilibrium and instantaneous moduli of a single sample into an excel file
+
+    # Building the output document into an excel file
+    stat_mod = xlwt.Workbook()
+
+    # Equ. :
+    final_equ_data = stat_mod.add_sheet('Equ Mod.')
+    final_equ_data.write(0, 0, 'Data')
+
+    for i in range(equ_mod_data.shape[1]):
+        final_equ_data.write(0, i+1, f'Step {i}')
+
+    header = ['Hayes ratio', 'Equ kappa', 'Equ stress', 'Stepwise Equ mod', 'fitted Equ mod', 'Crt stepwise equ', 'Crt fitted equ']
+    for label in range(len(header)):
+        final_equ_data.write(label+1, 0, header[label])
+    for i in range(equ_mod_data.shape[1]):
+        for j in range(7):
+            final_equ_data.write(j+1, i+1, equ_mod_data[j][i])
+
+    # Inst. :
+    final_inst_data = stat_mod.add_sheet('Inst Mod.')
+    final_inst_data.write(0, 0, 'Data')
+    for i in range(equ_mod_data.shape[1]):
+        final_inst_data.write(0, i+1, f'Step {i}')
+
+    header = ['Hayes ratio', 'Inst kappa', 'Inst stress', 'Stepwise Inst mod', 'fitted Inst mod', 'Crt stepwise Inst',
+              'Crt fitted Inst']
+    for label in range(len(header)):
+        final_inst_data.write(label + 1, 0, header[label])
+
+    for i in range(equ_mod_data.shape[1]):
+        for j in range(7):
+            final_inst_data.write(j + 1, i + 1, inst_mod_data[j][i])
+
+    stat_mod.save(output_file)
+
+
+def group_map_files(file_list):
+    # Grouping the input files per sample with the coordinates of their locations, the other files are skipped
+    samples = {}
     for file in file_list:
-        input_data = np.loadtxt(f'{input_dir}\\{file}')
-
-        # Equilibrium Modulus
-        equ_mod_data = np.zeros((7, input_data.shape[1]))
-
-        # Preliminary data required for estimating the Hayes' corrected equilibrium modulus.
-        for step in range(input_data.shape[1]):
-            equ_mod_data[0][step] = radius/input_data[0][step] # Hayes' ratio (a/h), a = radius of indenter = 1/2
-            equ_mod_data[1][step] = equ_k_interpolating(equ_mod_data[0][step]) # Equilibrium kappa for Hayes' correction
-            equ_mod_data[2][step] = input_data[4][step]/ (math.pi*radius*radius) # Equilibrium stress
-            equ_mod_data[3][step] = equ_mod_data[2][step]/input_data[2][step] # Step-wise init. Equilibrium mod.
-
-        # Corrected equ.
-        for step in range(input_data.shape[1]):
-            # Init. equ. mod based on fitted line to equ. stresses and strains
-            equ_mod_data[4][step] = fit(input_data[1, :], equ_mod_data[2, :], 1)[0]
-
-            # Corrected step-wise equ. mod. for the step-wise init. equ. mod.
-            equ_mod_data[5][step] = ((1 - pow(poisson_eq, 2)) * math.pi * equ_mod_data[0][step] * (
-                    equ_mod_data[2][step]/input_data[1][step])) / (2 * equ_mod_data[1][step])
-
-            equ_mod_data[6][step] = ((1 - pow(poisson_eq, 2)) * math.pi * equ_mod_data[0][0] * equ_mod_data[4][step]) / (
-                    2 * equ_mod_data[1][0]) # Corrected fitted equ. mod. for the fitted init. equ. mod.
-
-        # Instantaneous Modulus
-        inst_mod_data = np.zeros((7, input_data.shape[1]))
-
-        # Preliminary data required for estimating the Hayes' corrected instantaneous modulus.
-        for step in range(input_data.shape[1]):
-            inst_mod_data[0][step] = radius/input_data[0][step]  # Hayes' ratio (a/h)
-            inst_mod_data[1][step] = inst_k_interpolating(inst_mod_data[0][step]) # Inst. kappa for Hayes' correction
-            inst_mod_data[2][step] = input_data[7][step] / (math.pi * radius * radius)  # inst. stress
-            inst_mod_data[3][step] = inst_mod_data[2][step] / input_data[2][step]  # Step-wise init. inst. mod.
-
-        # Corrected Inst.
-        for step in range(input_data.shape[1]):
-            # Init. inst. mod based on fitted line to inst. stresses and strains
-            inst_mod_data[4][step] = fit(input_data[1, :], inst_mod_data[2, :], 1)[0]
-
-            # Corrected step-wise inst. mod. for the step-wise init. inst. mod.
-            inst_mod_data[5][step] = ((1 - pow(poisson_inst, 2)) * math.pi * inst_mod_data[0][step] * (inst_mod_data[2][step]/input_data[1][step])) / (
-                        2 * inst_mod_data[1][step])
-
-            # Corrected fitted inst. mod. for the fitted init. inst. mod.
-            inst_mod_data[6][step] = ((1 - pow(poisson_inst, 2)) * math.pi * inst_mod_data[0][0] * inst_mod_data[4][step]) / (
-                        2 * inst_mod_data[1][0])
-
-        # Building the output document into an excel file
-        stat_mod = xlwt.Workbook()
-
-        # Equ. :
-        final_equ_data = stat_mod.add_sheet('Equ Mod.')
-        final_equ_data.write(0, 0, 'Data')
-
-        for i in range(input_data.shape[1]):
-            final_equ_data.write(0, i+1, f'Step {i}')
-
-        header = ['Hayes ratio', 'Equ kappa', 'Equ stress', 'Stepwise Equ mod', 'fitted Equ mod', 'Crt stepwise equ', 'Crt fitted equ']
-        for label in range(len(header)):
-            final_equ_data.write(label+1, 0, header[label])
-        for i in range(input_data.shape[1]):
-            for j in range(7):
-                final_equ_data.write(j+1, i+1, equ_mod_data[j][i])
-
-        # Inst. :
-        final_inst_data = stat_mod.add_sheet('Inst Mod.')
-        final_inst_data.write(0, 0, 'Data')
-        for i in range(input_data.shape[1]):
-            final_inst_data.write(0, i+1, f'Step {i}')
-
-        header = ['Hayes ratio', 'Inst kappa', 'Inst stress', 'Stepwise Inst mod', 'fitted Inst mod', 'Crt stepwise Inst',
-                  'Crt fitted Inst']
-        for label in range(len(header)):
-            final_inst_data.write(label + 1, 0, header[label])
-
-        for i in range(input_data.shape[1]):
-            for j in range(7):
-                final_inst_data.write(j + 1, i + 1, inst_mod_data[j][i])
-
-        stat_mod.save(f'{output_dir}\\{file[:-4]}-StaticElasticModuli.xls')
-
-    check = input('Do you want to continue?(Y/N) --> ')
-    if check == 'Y':
-        condition = True
-    elif check == 'N':
-        condition = False
+        match = location_pattern.match(file)
+        if match:
+            samples.setdefault(match['sample'], []).append((float(match['x']), float(match['y']), file))
+    return samples
+
+
+def stack_input_data(input_files):
+    # Stacking the input data of many locations into a 3D array (locations x 8 x steps), missing steps are NaN
+    input_data = [np.loadtxt(file, ndmin=2) for file in input_files]
+    input_stack = np.full((len(input_data), 8, max(data.shape[1] for data in input_data)), np.nan)
+    for location in range(len(input_data)):
+        input_stack[location, :, :input_data[location].shape[1]] = input_data[location]
+    return input_stack
+
+
+def moduli_map(coordinates, equ_mod_data, inst_mod_data):
+    # Building the location x modulus grid from the coordinates (locations x 2) and the batch-estimated moduli
+    return np.column_stack([coordinates, equ_mod_data[:, 6, 0], inst_mod_data[:, 6, 0],
+                            equ_mod_data[:, 5], inst_mod_data[:, 5]])
+
+
+def save_moduli_map(map_data, output_file):
+    # Storing the location x modulus grid of a single sample into an excel file
+    n_steps = (map_data.shape[1] - 4) // 2
+    stat_map = xlwt.Workbook()
+
+    final_map_data = stat_map.add_sheet('Moduli Map')
+    header = ['x (mm)', 'y (mm)', 'Crt fitted equ', 'Crt fitted Inst'] + \
+             [f'Crt stepwise equ Step {i}' for i in range(n_steps)] + [f'Crt stepwise Inst Step {i}' for i in range(n_steps)]
+    for label in range(len(header)):
+        final_map_data.write(0, label, header[label])
+    for i in range(map_data.shape[0]):
+        for j in range(map_data.shape[1]):
+            if not np.isnan(map_data[i][j]):
+                final_map_data.write(i+1, j, map_data[i][j])
+
+    stat_map.save(output_file)
+
+
+def interpolate_surface_map(coordinates, values, resolution):
+    # Interpolating the moduli of the locations on a regular grid with the given resolution (mm)
+    # Returns a 2D array, the 1st row holds the x coordinates and the 1st column holds the y coordinates
+    # The grid spans all the locations, while only the locations with a finite modulus are interpolated
+    grid_x = np.arange(np.amin(coordinates[:, 0]), np.amax(coordinates[:, 0]) + resolution/2, resolution)
+    grid_y = np.arange(np.amin(coordinates[:, 1]), np.amax(coordinates[:, 1]) + resolution/2, resolution)
+    finite = np.isfinite(values)
+    coordinates, values = coordinates[finite], values[finite]
+
+    # Linear interpolation needs locations spanning a surface, e.g., not a line scan, otherwise the nearest is used
+    if len(values) == 0:
+        surface = np.full((len(grid_y), len(grid_x)), np.nan)
     else:
-        print('Wrong input --> Exiting...')
-        exit()
+        spans_surface = len(values) > 2 and np.linalg.matrix_rank(coordinates - np.mean(coordinates, axis=0)) == 2
+        method = 'linear' if spans_surface else 'nearest'
+        surface = interpolate.griddata(coordinates, values, tuple(np.meshgrid(grid_x, grid_y)), method=method)
+
+    surface_map = np.full((len(grid_y) + 1, len(grid_x) + 1), np.nan)
+    surface_map[0, 1:] = grid_x
+    surface_map[1:, 0] = grid_y
+    surface_map[1:, 1:] = surface
+    return surface_map
+
+
+if __name__ == '__main__':
+
+    print(__doc__)
+
+    root = tk.Tk()
+    root.withdraw()
+
+    condition = True
+    while condition == True:
+
+        # Reading the input and output directories
+        output_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the output directory')
+        input_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Select the input directory')
+
+        # Listing all the input files ready for the estimator
+        input_files = os.listdir(input_dir)
+        file_list = sorted(input_files, key=lambda x: int("".join([i for i in x if i.isdigit()])))
+
+        # Reading infromation required for estimating the elastic moduli
+        radius = float(input('Inser the radius of the indenter (mm) --> ')) # The radius of the indenter
+        poisson_eq = float(input('Inser the Poisson\'s value for equilibrium modulus --> ')) # The Poisson's value at equilibrium
+        poisson_inst = float(input('Inser the Poisson\'s value for instantaneous modulus --> ')) # The Poisson's value at instantaneous
+
+        # Choosing the indentation-map mode
+        map_mode = input('Use the indentation-map mode?(Y/N) --> ')
+
+        if map_mode == 'Y':
+            resolution = float(input('Insert the resolution of the surface maps (mm), 0 for no surface map --> '))
+
+            for sample, locations in group_map_files(file_list).items():
+                # Estimating the moduli of all the locations of the sample at once
+                coordinates = np.array([[x, y] for x, y, _ in locations])
+                input_stack = stack_input_data([f'{input_dir}\\{file}' for _, _, file in locations])
+                equ_mod_data, inst_mod_data = estimate_static_moduli_batch(input_stack, radius, poisson_eq, poisson_inst)
+
+                map_data = moduli_map(coordinates, equ_mod_data, inst_mod_data)
+                save_moduli_map(map_data, f'{output_dir}\\{sample}-StaticElasticModuli-Map.xls')
+                np.savetxt(f'{output_dir}\\{sample}-StaticElasticModuli-Map.txt', map_data, delimiter='\t')
+
+                if resolution > 0:
+                    np.savetxt(f'{output_dir}\\{sample}-EquMod-SurfaceMap.txt',
+                               interpolate_surface_map(coordinates, map_data[:, 2], resolution), delimiter='\t')
+                    np.savetxt(f'{output_dir}\\{sample}-InstMod-SurfaceMap.txt',
+                               interpolate_surface_map(coordinates, map_data[:, 3], resolution), delimiter='\t')
+        else:
+            for file in file_list:
+                input_data = np.loadtxt(f'{input_dir}\\{file}')
+
+                equ_mod_data, inst_mod_data = estimate_static_moduli(input_data, radius, poisson_eq, poisson_inst)
+                save_static_moduli(equ_mod_data, inst_mod_data, f'{output_dir}\\{file[:-4]}-StaticElasticModuli.xls')
+
+        check = input('Do you want to continue?(Y/N) --> ')
+        if check == 'Y':
+            condition = True
+        elif check == 'N':
+            condition = False
+        else:
+            print('Wrong input --> Exiting...')
+            exit()
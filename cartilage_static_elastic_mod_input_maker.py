@@ -7,7 +7,7 @@ Licence: MIT
 version: 0.1
 =========================================================
 How to use:
-1. Select ll the step-wise stress-relaxation files per sample.
+1. Select ll the step-wise stress-relaxation files per sample, either as text or compact (.npz) files.
 2. Select the output directory.
 3. Input the sample's label.
 4. Input the sample's thickness in mm.
@@ -40,35 +40,16 @@ TODO for version O.2
 =========================================================
 '''
 
-print(__doc__)
-
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
+from biomomentum_compact_curve_storage import load_curve
 
 
-root = tk.Tk()
-root.withdraw()
-
-condition = True
-while condition == True:
-
-    # Reading the stress-relaxation files per sample for all the steps
-    input_files = filedialog.askopenfilenames(parent=root, initialdir='C:\\', title='Select the sample\'s stress-relaxation files for all the steps')
-
-    # Selecting the output directory
-    output_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the output directory')
-
-    # Reading the sample's label:
-    label = input('Insert the sample\'s label --> ')
+def make_mod_input(step_files, thickness, strains):
+    # Building the input data of a single sample from its step-wise stress-relaxation files
+    # The step files must be ordered by step, and the strains are given per step
 
-    # Reading the thickness of the sample
-    thickness = float(input('Insert the sample\'s thickness (mm) --> '))
-
-    # Reading the strains used per step
-    strains = list(','.split(input('List the strains used in experiments, separate them with a comma (,) --> ')))
-
-    # Building the input data file for estimating the inst. and eq. moduli.
     # The input data includes measured thickness at 3 steps, (thickness measured by microscope)
     # Assumed strain (0.05, 0. 10, 0.15)
     # Accumulated measured strain ((last pt - first pt)/first pt) at each step
@@ -78,7 +59,7 @@ while condition == True:
     # Equ. force (avg og last 3000 pts.)
     mod_input_data = np.zeros((8, len(strains)))
     for step in range(len(strains)):
-        file = np.loadtxt(input_files[step])
+        file = load_curve(step_files[step])
         if step > 0:
             mod_input_data[0][step] = mod_input_data[0][step-1]*(1-float(strains[step-1]))
         else:
@@ -95,13 +76,44 @@ while condition == True:
         else:
             mod_input_data[7][step] = mod_input_data[6][step]-mod_input_data[5][step]
 
-    np.savetxt(f'{output_dir}\\{label}-StaticElasticMod-Input.txt', mod_input_data, delimiter='\t')
+    return mod_input_data
+
+
+if __name__ == '__main__':
+
+    print(__doc__)
 
-    check = input('Do you want to continue?(Y/N) --> ')
-    if check == 'Y':
-        condition = True
-    elif check == 'N':
-        condition = False
-    else:
-        print('Wrong input --> Exiting...')
-        exit()
+    root = tk.Tk()
+    root.withdraw()
+
+    condition = True
+    while condition == True:
+
+        # Reading the stress-relaxation files per sample for all the steps
+        input_files = filedialog.askopenfilenames(parent=root, initialdir='C:\\', title='Select the sample\'s stress-relaxation files for all the steps')
+
+        # Selecting the output directory
+        output_dir = filedialog.askdirectory(parent=root, initialdir='C:\\', title='Choose the output directory')
+
+        # Reading the sample's label:
+        label = input('Insert the sample\'s label --> ')
+
+        # Reading the thickness of the sample
+        thickness = float(input('Insert the sample\'s thickness (mm) --> '))
+
+        # Reading the strains used per step
+        strains = input('List the strains used in experiments, separate them with a comma (,) --> ').split(',')
+
+        # Building the input data file for estimating the inst. and eq. moduli.
+        mod_input_data = make_mod_input(input_files, thickness, strains)
+
+        np.savetxt(f'{output_dir}\\{label}-StaticElasticMod-Input.txt', mod_input_data, delimiter='\t')
+
+        check = input('Do you want to continue?(Y/N) --> ')
+        if check == 'Y':
+            condition = True
+        elif check == 'N':
+            condition = False
+        else:
+            print('Wrong input --> Exiting...')
+            exit()